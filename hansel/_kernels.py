@@ -0,0 +1,67 @@
+"""Optional compiled kernels for the hot paths of Hansel.
+
+If numba is not installed, each kernel is None and Hansel falls back to
+its NumPy implementation.
+"""
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+def _jit(func):
+    if njit is None:
+        return None
+    return njit(cache=True)(func)
+
+
+def _valid_symbols_seen(arr, at_pos, valid_idx):
+    # The number of valid symbols with any unspent observations at at_pos,
+    # as counted from the row sums of get_counts_at
+    n_symbols = arr.shape[3]
+    seen = 0
+    for a in valid_idx:
+        for b in range(n_symbols):
+            if arr[at_pos, at_pos+1, a, b] >= 1.0:
+                seen += 1
+                break
+    return seen
+
+
+def _spanning_support(arr, symbol_to, pos_i, pos_j, valid_idx):
+    # As get_spanning_support, for an already oriented pair of positions
+    total = 0.0
+    for a in valid_idx:
+        v = arr[pos_i, pos_j, a, symbol_to]
+        if v >= 1.0:
+            total += v
+    return total
+
+
+def _edge_log_conditionals(arr, path_idx, symbol_pos, l_limit, branch_idx, valid_idx):
+    # Sum the log10 conditionals of each branch at symbol_pos over the last
+    # l_limit symbols of the path, as get_edge_weights_at does one lookback
+    # position at a time. Cells below 1 are spent evidence and count as 0.
+    scores = np.zeros(len(branch_idx))
+    for l in range(l_limit):
+        curr_i = len(path_idx) - 1 - l
+        pos_i = min(curr_i, symbol_pos)
+        pos_j = max(curr_i, symbol_pos)
+        av = valid_symbols_seen(arr, curr_i, valid_idx)
+
+        symbol_from = path_idx[curr_i]
+        for k in range(len(branch_idx)):
+            symbol_to = branch_idx[k]
+            obs = arr[pos_i, pos_j, symbol_from, symbol_to]
+            if obs < 1.0:
+                obs = 0.0
+            total = spanning_support(arr, symbol_to, pos_i, pos_j, valid_idx)
+            scores[k] += np.log10((1.0 + obs) / (av + total))
+    return scores
+
+
+valid_symbols_seen = _jit(_valid_symbols_seen)
+spanning_support = _jit(_spanning_support)
+edge_log_conditionals = _jit(_edge_log_conditionals)
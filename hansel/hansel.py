@@ -1,7 +1,8 @@
-from math import log10
-
 import numpy as np
 
+from . import _kernels
+
+
 class HanselSymbol(int):
     """Shim integer that allows an int to masquerade as a str.
     HanselSymbol essentially acts as an int, but when coerced to a str, it will
@@ -9,8 +10,9 @@ class HanselSymbol(int):
     Hansel symbol."""
 
     def __new__(cls, symbol_lookup, value):
-        cls.symbol_lookup = symbol_lookup
-        return int.__new__(cls, value)
+        obj = int.__new__(cls, value)
+        obj.symbol_lookup = symbol_lookup
+        return obj
 
     def __str__(self):
         return self.symbol_lookup.get(self, None)
@@ -40,9 +42,12 @@ class Hansel(np.ndarray):
     ----------
 
     input_arr : 4D numpy array
-        A numpy array (typically initialised with zeros) of size (A, A, B+2, B+2),
+        A numpy array (typically initialised with zeros) of size (B+2, B+2, A, A),
         where `A` is the number of `symbols` + `unsymbols` and `B` are the points in time or
         space on which pairwise observations between symbols can be observed.
+        Positions lead so that the (A, A) plane of symbol pairs for any pair
+        of positions is contiguous in memory. The layout is internal: the API
+        still takes symbols before positions.
 
     symbols : list{str}
         A list of permitted states or symbols as strings.
@@ -86,10 +91,18 @@ class Hansel(np.ndarray):
 
     """
     def __new__(cls, input_arr, symbols, unsymbols, L=0):
+        if symbols is None or len(symbols) == 0:
+            raise ValueError("Attempted to allocate Hansel structure without symbols.")
+
         # Force our class on the input_arr
         #TODO Is there an overhead in casting a view here (are we copying the
         #     big matrix to a new object? :(
-        obj = np.asarray(input_arr).view(cls)
+        input_arr = np.asarray(input_arr)
+        n_symbols = len(symbols)
+        if (input_arr.ndim != 4 or input_arr.shape[0] != input_arr.shape[1]
+                or input_arr.shape[2] != n_symbols or input_arr.shape[3] != n_symbols):
+            raise ValueError("Attempted to allocate Hansel structure from an array of shape %s, expected (n_positions, n_positions, %d, %d) for (pos_from, pos_to, symbol_from, symbol_to)." % (input_arr.shape, n_symbols, n_symbols))
+        obj = input_arr.view(cls)
 
         obj.n_slices= 0
         obj.n_crumbs = 0
@@ -97,13 +110,33 @@ class Hansel(np.ndarray):
         obj.symbols = symbols
         obj.symbols_d = {symbol: i for i, symbol in enumerate(symbols)}
         obj.symbols_i = {i: symbol for i, symbol in enumerate(symbols)}
+        # One HanselSymbol per symbol, handed out rather than built per call
+        obj._symbol_objs = [HanselSymbol(obj.symbols_i, i) for i in range(len(symbols))]
 
         obj.is_weighted = False
 
         obj.unsymbols = unsymbols
         obj.L = L
 
-        obj.valid_symbols_i = {i: symbol for i, symbol in enumerate(symbols) if symbol not in unsymbols}
+        # Validity is decided once here; the mask and index array are what
+        # the hot paths test against, rather than the unsymbols list
+        unsymbols_set = set(unsymbols)
+        obj._valid_mask = np.array([symbol not in unsymbols_set for symbol in symbols], dtype=bool)
+        obj._valid_idx = np.flatnonzero(obj._valid_mask)
+        obj.valid_symbols_i = {i: symbols[i] for i in obj._valid_idx.tolist()}
+
+        # Single character symbols can be translated to indices in bulk by
+        # indexing a 256 entry table with the bytes of a sequence
+        obj._ord_to_idx = None
+        if all(len(symbol) == 1 and ord(symbol) < 256 for symbol in symbols):
+            obj._ord_to_idx = np.full(256, -1, dtype=np.intp)
+            for i, symbol in enumerate(symbols):
+                obj._ord_to_idx[ord(symbol)] = i
+
+        obj._counts_cache = {}
+        obj._span_cache = {}
+        obj._log_cond_cache = {}
+        obj._row_sums_buf = None
         return obj
 
     #NOTE Provides support for construction mechanisms of numpy
@@ -134,32 +167,52 @@ class Hansel(np.ndarray):
         self.L = getattr(obj, 'L', 0)
 
         self.symbols_i = getattr(obj, 'symbols_i', {})
+        self._symbol_objs = getattr(obj, '_symbol_objs', [])
         self.valid_symbols_i = getattr(obj, 'valid_symbols_i', {})
-
-        #TODO Safer warning?
-        if self.symbols is None or len(self.symbols) == 0:
-            import sys
-            sys.stderr.write("[FAIL] Attempted to allocate Hansel structure without symbols.\n")
-            sys.exit(1)
+        self._valid_idx = getattr(obj, '_valid_idx', np.empty(0, dtype=np.intp))
+        self._valid_mask = getattr(obj, '_valid_mask', np.zeros(0, dtype=bool))
+        self._ord_to_idx = getattr(obj, '_ord_to_idx', None)
+        self._row_sums_buf = None
+        if self.ndim == 4:
+            # Only a full (P, P, A, A) structure can be queried, so slices
+            # and reductions are not given caches of their own
+            self._counts_cache = {}
+            self._span_cache = {}
+            self._log_cond_cache = {}
 
     @staticmethod
-    def init_matrix(symbols, unsymbols, n_positions):
+    def init_matrix(symbols, unsymbols, n_positions, dtype=np.float32):
+        """Allocate a zeroed, shared memory Hansel structure.
+
+        Parameters
+        ----------
+
+        symbols : list{str}
+            A list of permitted states or symbols as strings.
+
+        unsymbols : list{str}
+            A list of permitted states that may represent the known absence of a symbol.
+
+        n_positions : int
+            The number of points in time or space on which pairwise observations
+            between symbols can be observed.
+
+        dtype : numpy dtype, optional(default=np.float32)
+            The type of each cell. A narrower integer type (such as `np.uint16`)
+            reduces the memory and bandwidth needed for plain counts, but a
+            floating type is required if the structure is to be reweighted.
+        """
         from multiprocessing import Array
-        import ctypes
 
         n_symbols = len(symbols)
         n_positions += 2 # Add a position for the start source and end sink
-        hanselx = np.frombuffer(Array(ctypes.c_float, n_symbols * n_symbols * n_positions * n_positions, lock=False), dtype=ctypes.c_float)
-        hanselx = hanselx.reshape(n_symbols, n_symbols, n_positions, n_positions)
-        hanselx.fill(0.0) # Initialise as empty
+        # multiprocessing.Array zeroes its memory on allocation, so the
+        # structure is already empty without another pass to fill it
+        ctype = np.ctypeslib.as_ctypes_type(dtype)
+        hanselx = np.frombuffer(Array(ctype, n_symbols * n_symbols * n_positions * n_positions, lock=False), dtype=dtype)
+        hanselx = hanselx.reshape(n_positions, n_positions, n_symbols, n_symbols)
         return Hansel(hanselx, symbols, unsymbols)
 
-    def __orient_positions(self, i, j):
-        if i < j:
-            return i, j
-        else:
-            return j, i
-
     #def __orient_symbols(self, symbol_a, symbol_b, pos_from, pos_to, mirror=False):
     #    if not mirror:
     #        if pos_from < pos_to:
@@ -205,12 +258,109 @@ class Hansel(np.ndarray):
 
         """
         #self.n_crumbs += 1 # This doesn't work when updating the matrix in parallel, users should set it manually instead
-        pos_from, pos_to = self.__orient_positions(pos_from, pos_to)
-        self[self.__symbol_num(symbol_from), self.__symbol_num(symbol_to), pos_from, pos_to] += value
+        if self.dtype.kind != 'f':
+            self.__check_integral(value)
+        pos_from, pos_to = (pos_from, pos_to) if pos_from < pos_to else (pos_to, pos_from)
+        self[pos_from, pos_to, self.symbols_d[symbol_from], self.symbols_d[symbol_to]] += value
+        self._counts_cache.pop(pos_from, None)
+        self._span_cache.pop((pos_from, pos_to), None)
+        self._log_cond_cache.pop((pos_from, pos_to), None)
+        self._log_cond_cache.pop((pos_to, pos_from), None)
+
+    def add_sequence_observations(self, sequence, pos_start, value=1):
+        """Add a pairwise observation for every pair of symbols in a sequence
+        observed across consecutive positions.
+
+        This is equivalent to calling :meth:`add_observation` for every
+        `symbol_from` at `i` and `symbol_to` at `j` for `i < j`, but all of
+        the observations are added to the matrix at once.
+
+        Parameters
+        ----------
+
+        sequence : str or list{str}
+            The observed symbols, in order. A `str` (or `bytes`) may be
+            given if all symbols are single characters.
+
+        pos_start : int
+            The "position" at which the first symbol of `sequence` was observed.
+
+        value : float, optional(default=1)
+            Magnitude of each observation (defaults to 1).
+
+        """
+        if self.dtype.kind != 'f':
+            self.__check_integral(value)
+        idx = self._symbols_to_idx(sequence)
+        i, j = np.triu_indices(len(idx), k=1)
+        np.add.at(np.asarray(self), (i + pos_start, j + pos_start, idx[i], idx[j]), value)
+        self.__forget_cached(i + pos_start, j + pos_start)
+
+    def add_observations(self, symbols_from, symbols_to, positions_from, positions_to, value=1):
+        """Add many pairwise observations to the data structure at once.
+
+        This is equivalent to calling :meth:`add_observation` for each
+        element of the given sequences in turn.
+
+        Parameters
+        ----------
+
+        symbols_from : str or list{str}
+            The first observed symbol of each pair (in space or time).
+            A `str` (or `bytes`) may be given if all symbols are single characters,
+            or an int array of symbol indices may be given in place of symbols.
+
+        symbols_to : str or list{str}
+            The second observed symbol of each pair (in space or time).
+
+        positions_from : list{int}
+            The "position" at which each of `symbols_from` was observed.
+
+        positions_to : list{int}
+            The "position" at which each of `symbols_to` was observed.
+
+        value : float or list{float}, optional(default=1)
+            Magnitude of each observation (defaults to 1).
+
+        """
+        if self.dtype.kind != 'f':
+            self.__check_integral(value)
+        idx_from = self._symbols_to_idx(symbols_from)
+        idx_to = self._symbols_to_idx(symbols_to)
+        positions_from = np.asarray(positions_from, dtype=np.intp)
+        positions_to = np.asarray(positions_to, dtype=np.intp)
+
+        # Broadcast everything to one flat run of observations up front, so
+        # a scalar position is expanded before the matrix is touched
+        pos_i, pos_j, idx_from, idx_to = [np.ravel(a) for a in np.broadcast_arrays(
+            np.minimum(positions_from, positions_to),
+            np.maximum(positions_from, positions_to),
+            idx_from,
+            idx_to,
+        )]
+        np.add.at(np.asarray(self), (pos_i, pos_j, idx_from, idx_to), value)
+        self.__forget_cached(pos_i, pos_j)
+
+    def __check_integral(self, value):
+        # Integer cells would silently truncate a fractional observation
+        if np.any(np.mod(value, 1) != 0):
+            raise TypeError("Cannot add fractional observations to a Hansel structure with %s cells, allocate it with a floating dtype." % self.dtype)
+
+    def __forget_cached(self, pos_i, pos_j):
+        # Drop anything memoised for each oriented pair of positions in the
+        # given arrays, skipping the work entirely while the caches are empty
+        if self._counts_cache:
+            for pos in pos_i[pos_j == pos_i + 1].tolist():
+                self._counts_cache.pop(pos, None)
+        if self._span_cache or self._log_cond_cache:
+            for pair in zip(pos_i.tolist(), pos_j.tolist()):
+                self._span_cache.pop(pair, None)
+                self._log_cond_cache.pop(pair, None)
+                self._log_cond_cache.pop(pair[::-1], None)
 
     def __get_observation(self, symbol_from, symbol_to, pos_from, pos_to):
-        pos_from, pos_to = self.__orient_positions(pos_from, pos_to)
-        v = self[symbol_from, symbol_to, pos_from, pos_to]
+        pos_from, pos_to = (pos_from, pos_to) if pos_from < pos_to else (pos_to, pos_from)
+        v = self[pos_from, pos_to, symbol_from, symbol_to]
 
         # reweight_matrix destroys evidence without checking for <1 cells for speed
         # so let's check for it here instead
@@ -248,7 +398,7 @@ class Hansel(np.ndarray):
                 a `float` if :attr:`hansel.hansel.Hansel.is_weighted`
                 is `True`.
         """
-        return self.__get_observation(self.__symbol_num(symbol_from), self.__symbol_num(symbol_to), pos_from, pos_to)
+        return self.__get_observation(self.symbols_d[symbol_from], self.symbols_d[symbol_to], pos_from, pos_to)
 
     def reweight_observation(self, symbol_from, symbol_to, pos_from, pos_to, ratio):
         """Alter the number of co-occurrences between a pair of positioned symbols by some ratio.
@@ -274,36 +424,90 @@ class Hansel(np.ndarray):
             The ratio by which to subtract the current number of observations.
             That is, `new_value = old_value - (ratio * old_value)`.
         """
+        if self.dtype.kind != 'f':
+            raise TypeError("Cannot reweight a Hansel structure with %s cells, allocate it with a floating dtype." % self.dtype)
+
+        pos_i, pos_j = (pos_from, pos_to) if pos_from < pos_to else (pos_to, pos_from)
+        self._counts_cache.pop(pos_i, None)
+        self._span_cache.pop((pos_i, pos_j), None)
+        self._log_cond_cache.pop((pos_i, pos_j), None)
+        self._log_cond_cache.pop((pos_j, pos_i), None)
+        self.is_weighted = True
 
-        s_a = symbol_from
-        s_b = symbol_to
-        pos_i, pos_j = self.__orient_positions(pos_from, pos_to)
-
-        old_v = self[s_a, s_b, pos_i, pos_j]
-        new_v = old_v - (ratio*old_v)
+        idx = (pos_i, pos_j, symbol_from, symbol_to)
+        old_v = float(self[idx])
+        if old_v == 0:
+            return 0.0
 
-        if old_v != 0:
-            if new_v < 1:
-                # Once the last whole crumb of evidence has been used, set it to 0
-                # otherwise we will ~infinitely take smaller and smaller decimal crumbs away
-                self[s_a, s_b, pos_i, pos_j] = 0
-                return old_v
-            else:
-                self[s_a, s_b, pos_i, pos_j] = new_v
-                return old_v - new_v
-        self.is_weighted = True
-        return 0.0
+        new_v = old_v * (1.0 - ratio)
+        if new_v < 1:
+            # Once the last whole crumb of evidence has been used, set it to 0
+            # otherwise we will ~infinitely take smaller and smaller decimal crumbs away
+            self[idx] = 0
+            return old_v
+        self[idx] = new_v
+        return old_v - new_v
 
     def reweight_matrix(self, ratio):
-        total = self.sum()
-        self = self - (self*ratio)
+        """Alter the number of co-occurrences between every pair of positioned symbols by some ratio.
+
+        .. note:: This function will set :attr:`hansel.hansel.Hansel.is_weighted` to `True`.
+
+        Parameters
+        ----------
+
+        ratio : float
+            The ratio by which to subtract the current number of observations.
+            That is, `new_value = old_value - (ratio * old_value)`.
+
+        Returns
+        -------
+        Removed observations : float
+            The total number of observations removed from the structure.
+        """
+        if self.dtype.kind != 'f':
+            raise TypeError("Cannot reweight a Hansel structure with %s cells, allocate it with a floating dtype." % self.dtype)
+
+        # Scale the cells in place, in a single pass over the matrix
+        arr = np.asarray(self)
+        total = float(arr.sum(dtype=np.float64))
+        np.multiply(arr, 1.0 - ratio, out=arr)
         self.is_weighted = True
-        return total - self.sum()
+        self.clear_counts_cache()
+        return total - float(arr.sum(dtype=np.float64))
+
+    def clear_counts_cache(self):
+        """Forget all counts memoised by :meth:`get_counts_at` and
+        :meth:`get_spanning_support`, and the conditionals derived from them.
 
-    def __symbol_num(self, symbol):
-        #TODO Catch potential KeyError
-        #TODO Generic mechanism for casing (considering non-alphabetically named states, too...)
-        return self.symbols_d[symbol]
+        The caches are kept up to date by the observation and reweighting
+        functions, but must be cleared by hand after writing to the
+        underlying array directly (or from another process).
+        """
+        self._counts_cache.clear()
+        self._span_cache.clear()
+        self._log_cond_cache.clear()
+
+    def _symbols_to_idx(self, symbols):
+        # Translate a sequence of symbols (a str, bytes, or any iterable of
+        # symbols) to an array of their indices. Indices (such as a path of
+        # HanselSymbol, or an int array) are passed through as they are.
+        if isinstance(symbols, np.ndarray) and symbols.dtype.kind in 'iu':
+            return symbols.astype(np.intp, copy=False)
+        if self._ord_to_idx is not None:
+            if isinstance(symbols, str) and symbols.isascii():
+                symbols = symbols.encode("ascii")
+            if isinstance(symbols, (bytes, bytearray)):
+                idx = self._ord_to_idx[np.frombuffer(symbols, dtype=np.uint8)]
+                if (idx < 0).any():
+                    raise KeyError(chr(symbols[np.flatnonzero(idx < 0)[0]]))
+                return idx
+        if isinstance(symbols, (bytes, bytearray)):
+            symbols = symbols.decode("latin-1")
+        if isinstance(symbols, str):
+            # The characters of a str are always symbols, never indices
+            return np.fromiter((self.symbols_d[symbol] for symbol in symbols), dtype=np.intp)
+        return np.fromiter((symbol if isinstance(symbol, (int, np.integer)) else self.symbols_d[symbol] for symbol in symbols), dtype=np.intp)
 
     def __symbol_unnum(self, num):
         #TODO Catch potential IndexError
@@ -311,64 +515,112 @@ class Hansel(np.ndarray):
 
     def write_path_support_matrix(self, fname, path_a, path_b=None):
         # from    to  count_on    count_off   marginal_on marginal_off
-        fh = open(fname, 'w')
-        fh.write("\t".join([
-            "symbol_a",
-            "symbol_b",
-            "i",
-            "j",
-            "obs",
-            "total",
-        ])+'\n')
-
-        def count_and_write(s_a, s_b, pos_i, pos_j, flip=False):
-            #s_a, s_b, pos_i, pos_j = self.__orient_symbols(symbol_a, symbol_b, i, j, mirror=mirror)
-            obs = self.__get_observation(self.__symbol_num(s_a), self.__symbol_num(s_b), pos_i, pos_j)
-            total = self.get_counts_at(pos_j)["total"]
-
-            i, j = pos_i, pos_j
-            if flip:
-                i, j = pos_j, pos_i
-
-            fh.write("\t".join([str(x) for x in [
-                symbol_a,
-                symbol_b,
-                i,
-                j,
-                obs,
-                total,
-            ]]) + '\n')
-
+        # Collect the cells to report first, so their observations can be
+        # fetched in a single gather and the file written in one go
+        # Paths may be given as symbols or as symbol indices
+        rows = [] # symbol_a, symbol_b, i, j as written
+        cells = [] # symbol_from, symbol_to, pos_from, pos_to as observed
+
+        path_a = self._symbols_to_idx(path_a).tolist()
+        path_b = self._symbols_to_idx(path_b).tolist() if path_b is not None else []
         for i, symbol_a in enumerate(path_a):
             for j, symbol_b in enumerate(path_a):
                 if path_b:
                     if i > j:
                         # easier to do this here whatev
                         continue
-                count_and_write(symbol_a, symbol_b, i, j)
+                rows.append((self.symbols[symbol_a], self.symbols[symbol_b], i, j))
+                cells.append((symbol_a, symbol_b, i, j))
         if path_b:
             for i, symbol_a in enumerate(path_b):
                 for j, symbol_b in enumerate(path_b):
                     if i < j:
                         continue
-                    count_and_write(symbol_b, symbol_a, j, i, flip=True)
+                    rows.append((self.symbols[symbol_a], self.symbols[symbol_b], i, j))
+                    cells.append((symbol_b, symbol_a, j, i))
 
+        fh = open(fname, 'w')
+        fh.write("\t".join([
+            "symbol_a",
+            "symbol_b",
+            "i",
+            "j",
+            "obs",
+            "total",
+        ])+'\n')
+        if len(cells) == 0:
+            fh.close()
+            return
 
+        symbols_from, symbols_to, pos_from, pos_to = zip(*cells)
+        pos_from = np.array(pos_from, dtype=np.intp)
+        pos_to = np.array(pos_to, dtype=np.intp)
+        obs = np.asarray(self)[
+            np.minimum(pos_from, pos_to),
+            np.maximum(pos_from, pos_to),
+            np.array(symbols_from, dtype=np.intp),
+            np.array(symbols_to, dtype=np.intp),
+        ]
+        totals = {pos: self.__counts_at(pos)[0]["total"] for pos in set(pos_to.tolist())}
+
+        lines = []
+        for row, v, pos in zip(rows, obs, pos_to.tolist()):
+            # As __get_observation, spent (<1) evidence is reported as 0
+            lines.append("\t".join([str(x) for x in row + (v if v >= 1.0 else 0, totals[pos])]) + '\n')
+        fh.write("".join(lines))
         fh.close()
 
-    def load_hansel_dump(self, prefix):
+    def load_hansel_dump(self, prefix, n_threads=None):
         import glob
+        from concurrent.futures import ThreadPoolExecutor
+
         dump_names = glob.glob(prefix+"*hansel*txt")
-        for dump_fn in dump_names:
+        arr = np.asarray(self)
+
+        # Each symbol pair is its own file and its own slice of the matrix,
+        # so the files can be parsed concurrently
+        def load(dump_fn):
             symbol_a, symbol_b = dump_fn.split('.')[-2].split("~")
-            self[self.symbols_d[symbol_a], self.symbols_d[symbol_b]] = np.loadtxt(dump_fn, delimiter=',')
+            arr[:, :, self.symbols_d[symbol_a], self.symbols_d[symbol_b]] = np.loadtxt(dump_fn, delimiter=',')
+
+        with ThreadPoolExecutor(max_workers=n_threads) as ex:
+            list(ex.map(load, dump_names))
+        self.clear_counts_cache()
         return(dump_names)
 
-    def save_hansel_dump(self, prefix):
-        for symbol_a in self.symbols_d:
-            for symbol_b in self.symbols_d:
-                dump_fn = prefix + ".hansel.%s~%s.txt" % (symbol_a, symbol_b)
-                np.savetxt(dump_fn, self[self.symbols_d[symbol_a], self.symbols_d[symbol_b]], delimiter=',')
+    def save_hansel_dump(self, prefix, n_threads=None):
+        from concurrent.futures import ThreadPoolExecutor
+
+        arr = np.asarray(self)
+
+        def save(pair):
+            symbol_a, symbol_b = pair
+            dump_fn = prefix + ".hansel.%s~%s.txt" % (symbol_a, symbol_b)
+            np.savetxt(dump_fn, arr[:, :, self.symbols_d[symbol_a], self.symbols_d[symbol_b]], delimiter=',')
+
+        with ThreadPoolExecutor(max_workers=n_threads) as ex:
+            list(ex.map(save, [(a, b) for a in self.symbols_d for b in self.symbols_d]))
+
+    def load_hansel_npz(self, prefix):
+        """Load a matrix written by :meth:`save_hansel_npz` from `prefix.hansel.npz`."""
+        arr = np.asarray(self)
+        with np.load(prefix + ".hansel.npz") as npz:
+            pairs = list(npz.files)
+            for pair in pairs:
+                symbol_a, symbol_b = pair.split("~")
+                arr[:, :, self.symbols_d[symbol_a], self.symbols_d[symbol_b]] = npz[pair]
+        self.clear_counts_cache()
+        return pairs
+
+    def save_hansel_npz(self, prefix):
+        """Save the matrix as a single compressed archive, `prefix.hansel.npz`,
+        with one array per symbol pair keyed as `symbol_a~symbol_b`."""
+        arr = np.asarray(self)
+        np.savez_compressed(prefix + ".hansel.npz", **{
+            "%s~%s" % (symbol_a, symbol_b): arr[:, :, i, j]
+            for symbol_a, i in self.symbols_d.items()
+            for symbol_b, j in self.symbols_d.items()
+        })
 
     def get_counts_at(self, at_pos):
         """Get the counts for each symbol that appears at a given position.
@@ -387,23 +639,47 @@ class Hansel(np.ndarray):
             number of observations of that symbol at `at_pos`. The "total" is
             the sum of all observation counts.
         """
-        marg = {"total": 0}
-        if(at_pos == 0):
-            permitted_a_symbols = self.symbols_i
-        else:
-            permitted_a_symbols = self.valid_symbols_i
-
-        for symbol_a in permitted_a_symbols:
-            obs = 0
-            #TODO Should this be the other way around?
-            for symbol_b in self.symbols_i:
-                obs += self.__get_observation(symbol_a, symbol_b, at_pos, at_pos+1)
-
-            if obs > 0:
-                marg[HanselSymbol(self.symbols_i, symbol_a)] = obs
-                marg["total"] += obs
-
-        return marg
+        # Hand out a copy, so the caller cannot alter the memoised counts
+        return dict(self.__counts_at(at_pos)[0])
+
+    def __counts_at(self, at_pos):
+        # The memoised (counts, valid symbols seen, log10 marginals) of
+        # at_pos, computing them first if needed. The counts dict is shared
+        # with the cache and must not be modified.
+        cached = self._counts_cache.get(at_pos)
+        if cached is not None:
+            return cached
+
+        # Sum each symbol_a row of the (A, A) plane in one reduction, rather
+        # than fetching each of the A*A cells with __get_observation.
+        # As with __get_observation, cells that have fallen below 1 after
+        # a reweight_matrix are treated as spent evidence.
+        #TODO Should this be the other way around?
+        if self._row_sums_buf is None:
+            self._row_sums_buf = np.empty(len(self.symbols), dtype=np.float64)
+        plane = np.asarray(self)[at_pos, at_pos+1]
+        row_sums = np.sum(plane, axis=1, dtype=np.float64, where=plane >= 1.0, out=self._row_sums_buf)
+        if at_pos != 0:
+            # Only the source position may count observations from unsymbols
+            row_sums[~self._valid_mask] = 0
+
+        nonzero = np.flatnonzero(row_sums)
+        total = float(row_sums.sum())
+        marg = {"total": total}
+        for symbol_a, obs in zip(nonzero.tolist(), row_sums[nonzero].tolist()):
+            marg[self._symbol_objs[symbol_a]] = obs
+
+        # Keep the number of valid symbols seen and the log10 marginal of
+        # every valid symbol alongside the counts, for the conditionals and
+        # edge weights that are scored at this position
+        valid_symbols_seen = int(np.count_nonzero(row_sums[self._valid_mask]))
+        log_marginals = np.full(len(row_sums), -np.inf)
+        if total > 0:
+            with np.errstate(divide='ignore'):
+                np.log10(row_sums / total, out=log_marginals, where=self._valid_mask)
+        cached = (marg, valid_symbols_seen, log_marginals)
+        self._counts_cache[at_pos] = cached
+        return cached
 
     def get_marginal_of_at(self, of_symbol, at_symbol):
         """Get the marginal distribution of a symbol appearing at a position.
@@ -426,7 +702,7 @@ class Hansel(np.ndarray):
             proportion of all symbols observed at `at_symbol` being equal
             to `of_symbol`.
         """
-        marginal = self.get_counts_at(at_symbol)
+        marginal = self.__counts_at(at_symbol)[0]
         return marginal[of_symbol] / marginal["total"]
 
     def get_edge_weights_at(self, symbol_pos, current_path, debug=False):
@@ -440,7 +716,9 @@ class Hansel(np.ndarray):
 
         current_path : list{HanselSymbol}
             A list of symbols representing the path of selected symbols that led
-            to the current position, `symbol_pos`.
+            to the current position, `symbol_pos`. As symbols are only used
+            for their index, any sequence of int indices (such as an int
+            numpy array) may be given instead, saving a conversion.
 
         Returns
         -------
@@ -450,33 +728,104 @@ class Hansel(np.ndarray):
             The values are `log10` conditional probabilities of the next symbol
             in the path (or sequence) being that of the key.
         """
-        # ...work out each probability, for each branch
-        curr_branches = {}
-        for symbol in self.get_counts_at(symbol_pos):
-            if str(symbol) in self.unsymbols or str(symbol) == "total":
-                continue
+        counts = self.__counts_at(symbol_pos)[0]
+        branches = [symbol for symbol in counts if symbol != "total" and self._valid_mask[symbol]]
+        if len(branches) == 0:
+            return {}
 
-            curr_branches[symbol] = 0.0
+        # ...work out each probability, for all branches at once
+        branch_idx = np.array(branches, dtype=np.intp)
+        scores = np.zeros(len(branches))
 
-            if symbol_pos > 1:
-
-                # If the length of the path, without the sentinel is less than L,
-                # we can only inspect the available members of L so far...
-                if len(current_path)-1 < self.L:
-                    l_limit = len(current_path)-1
-                else:
-                    l_limit = self.L
+        if symbol_pos > 1:
 
+            # If the length of the path, without the sentinel is less than L,
+            # we can only inspect the available members of L so far...
+            if len(current_path)-1 < self.L:
+                l_limit = len(current_path)-1
+            else:
+                l_limit = self.L
+
+            arr = np.asarray(self)
+            path_idx = np.asarray(current_path, dtype=np.intp)
+            if _kernels.edge_log_conditionals is not None and not debug:
+                # Walk the whole lookback window in one compiled call. The kernel
+                # reads the matrix directly, so it does not use (or need) the
+                # conditionals memoised by __log_conditionals for the NumPy path
+                scores += _kernels.edge_log_conditionals(arr, path_idx, symbol_pos, l_limit, branch_idx, self._valid_idx)
+            else:
                 for l in range(0, l_limit):
                     curr_i = (len(current_path)-1) - l
-                    curr_branches[symbol] += log10(self.get_conditional_of_at(current_path[curr_i], symbol, curr_i, symbol_pos))
+
+                    log_cond = self.__log_conditionals(curr_i, symbol_pos)[path_idx[curr_i], branch_idx]
+                    if np.isinf(log_cond).any():
+                        # As get_conditional_of_at (and the kernel) when there is
+                        # no support at all for a branch
+                        raise ZeroDivisionError("float division by zero")
+                    scores += log_cond
                     if debug:
-                        print("%.15f" % log10(self.get_conditional_of_at(current_path[curr_i], symbol, curr_i, symbol_pos)), current_path[curr_i], symbol, curr_i, symbol_pos)
+                        for symbol, v in zip(branches, log_cond):
+                            print("%.15f" % v, self._symbol_objs[path_idx[curr_i]], symbol, curr_i, symbol_pos)
 
-            # Append the marginal of symbol at desired position
-            curr_branches[symbol] += log10(self.get_marginal_of_at(symbol, symbol_pos))
+        # Append the marginal of each symbol at desired position
+        scores += self.__log_marginals(symbol_pos)[branch_idx]
 
-        return curr_branches
+        return dict(zip(branches, scores.tolist()))
+
+    def viterbi_decode(self, n_positions=None):
+        """Find the most likely path of symbols under a first order model.
+
+        Each step is scored as :meth:`get_edge_weights_at` would score it with
+        a lookback `L` of 1, but rather than greedily selecting one step at a
+        time, the best scoring path over all positions is found by dynamic
+        programming over the (A, A) plane between each pair of adjacent positions.
+
+        Parameters
+        ----------
+
+        n_positions : int, optional(default=None)
+            The number of positions (after the start source) to decode.
+            Defaults to all positions.
+
+        Returns
+        -------
+        Path : list{HanselSymbol}
+            The most likely symbol at each position, starting from position 1.
+            The path ends early if a position has no observations of any valid symbol.
+
+        Log probability : float
+            The `log10` probability of the path.
+        """
+        if n_positions is None:
+            n_positions = self.shape[0] - 2
+        n_symbols = len(self.symbols)
+
+        scores = None
+        backptrs = []
+        for pos in range(1, n_positions+1):
+            log_marginals = self.__log_marginals(pos)
+            if np.isneginf(log_marginals).all():
+                break
+
+            if scores is None:
+                scores = log_marginals
+                continue
+
+            # Score every transition between adjacent positions at once
+            candidates = scores[:, None] + self.__log_conditionals(pos-1, pos)
+            backptr = candidates.argmax(axis=0)
+            scores = candidates[backptr, np.arange(n_symbols)] + log_marginals
+            backptrs.append(backptr)
+
+        if scores is None:
+            return [], float("-inf")
+
+        best = int(scores.argmax())
+        path = [best]
+        for backptr in reversed(backptrs):
+            path.append(int(backptr[path[-1]]))
+        path.reverse()
+        return [self._symbol_objs[symbol] for symbol in path], float(scores[best])
 
     #TODO Given/predicted is a bit misleading as they turn out to be the "wrong way around"
     def get_conditional_of_at(self, symbol_from, symbol_to, pos_from, pos_to):
@@ -504,19 +853,45 @@ class Hansel(np.ndarray):
             The conditional probability of `symbol_from` occurring at `pos_from`
             given observation of a predicted `symbol_to` at `pos_to`.
         """
-        marg_from = self.get_counts_at(pos_from)
         obs = self.__get_observation(symbol_from, symbol_to, pos_from, pos_to)
         total = self.get_spanning_support(symbol_to, pos_from, pos_to)
-        total_from = self.get_counts_at(pos_from)["total"]
-        marg_sym_from = self.get_marginal_of_at(symbol_from, pos_from)
 
-        valid_symbols_seen = 0
-        for s in self.valid_symbols_i:
-            if s in marg_from:
-                valid_symbols_seen += 1
+        valid_symbols_seen = self.__count_valid_symbols_seen(pos_from)
         return self.__estimate_conditional(valid_symbols_seen, obs, total)
+        #NOTE The marginal variant also needs the total and marginal of symbol_from at pos_from
+        #total_from = self.get_counts_at(pos_from)["total"]
+        #marg_sym_from = self.get_marginal_of_at(symbol_from, pos_from)
         #return self.__estimate_conditional_wmarginal(valid_symbols_seen, obs, total_from, total, marg_sym_from)
 
+    def __log_conditionals(self, pos_from, pos_to):
+        # The log10 conditional of every symbol_from at pos_from with every
+        # symbol_to at pos_to, as an (A, A) matrix, computed from one plane
+        # as get_conditional_of_at would compute each cell.
+        # The matrix is memoised until the plane is changed, and is also
+        # recomputed if the valid symbols seen at pos_from have changed,
+        # so only the plane itself needs invalidating on an update
+        av = self.__count_valid_symbols_seen(pos_from)
+        cached = self._log_cond_cache.get((pos_from, pos_to))
+        if cached is not None and cached[0] == av:
+            return cached[1]
+
+        pos_i, pos_j = (pos_from, pos_to) if pos_from < pos_to else (pos_to, pos_from)
+        plane = np.asarray(self)[pos_i, pos_j]
+        obs = np.where(plane >= 1.0, plane, 0).astype(np.float64)
+        # Symbols with no support at all are left as +inf, for the caller to reject
+        with np.errstate(divide='ignore'):
+            log_cond = np.log10((1 + obs) / (av + self.__spanning_supports(pos_i, pos_j)))
+        self._log_cond_cache[(pos_from, pos_to)] = (av, log_cond)
+        return log_cond
+
+    def __count_valid_symbols_seen(self, at_pos):
+        return self.__counts_at(at_pos)[1]
+
+    def __log_marginals(self, at_pos):
+        # The log10 marginal of every symbol at at_pos, -inf for unseen and
+        # invalid symbols, memoised with the counts by get_counts_at
+        return self.__counts_at(at_pos)[2]
+
     #TODO Should this be "number of sources", rather than "number of observations"
     def get_spanning_support(self, symbol_to, pos_from, pos_to):
         """Get the number of observations that span over two positions of interest, that also feature some symbol.
@@ -548,10 +923,18 @@ class Hansel(np.ndarray):
                 a `float` if :attr:`hansel.hansel.Hansel.is_weighted`
                 is `True`.
         """
-        total = 0
-        for symbol_from in self.valid_symbols_i:
-            total += self.__get_observation(symbol_from, symbol_to, pos_from, pos_to)
-        return total
+        pos_from, pos_to = (pos_from, pos_to) if pos_from < pos_to else (pos_to, pos_from)
+        return float(self.__spanning_supports(pos_from, pos_to)[symbol_to])
+
+    def __spanning_supports(self, pos_from, pos_to):
+        # The spanning support of every symbol_to over an oriented pair of
+        # positions, summed over the valid symbol_from rows in one reduction
+        supports = self._span_cache.get((pos_from, pos_to))
+        if supports is None:
+            plane = np.asarray(self)[pos_from, pos_to, self._valid_idx]
+            supports = np.sum(plane, axis=0, dtype=np.float64, where=plane >= 1.0)
+            self._span_cache[(pos_from, pos_to)] = supports
+        return supports
 
     def __estimate_conditional(self, av, obs, total):
         return (1 + obs)/float(av + total)
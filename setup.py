@@ -4,7 +4,7 @@
 import setuptools
 
 requirements = [
-    "numpy",
+    "numpy>=1.17",
 ]
 
 test_requirements = [
@@ -28,7 +28,11 @@ setuptools.setup(
     packages=setuptools.find_packages(),
     include_package_data=True,
 
+    python_requires=">=3.7",
     install_requires=requirements,
+    extras_require={
+        "numba": ["numba"],
+    },
 
     entry_points = {
     },
@@ -39,6 +43,7 @@ setuptools.setup(
         'Topic :: Scientific/Engineering',
         'Topic :: Scientific/Engineering :: Bio-Informatics',
         'License :: OSI Approved :: MIT License',
+        'Programming Language :: Python :: 3',
     ],
 
     test_suite="tests",
@@ -0,0 +1,36 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from hansel.hansel import Hansel
+
+SYMBOLS = ['A', 'C', 'G', 'T', 'N', '_']
+UNSYMBOLS = ['N', '_']
+
+
+class HanselNpzTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        rng = np.random.RandomState(0)
+        h = Hansel.init_matrix(SYMBOLS, UNSYMBOLS, 8)
+        np.asarray(h)[:] = rng.randint(0, 5, h.shape) * rng.rand(*h.shape)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            prefix = os.path.join(tmp, "test")
+            h.save_hansel_npz(prefix)
+
+            g = Hansel.init_matrix(SYMBOLS, UNSYMBOLS, 8)
+            # Anything memoised before the load must be forgotten
+            before = g.get_counts_at(1)
+            pairs = g.load_hansel_npz(prefix)
+
+        self.assertEqual(len(pairs), len(SYMBOLS) ** 2)
+        np.testing.assert_array_equal(np.asarray(g), np.asarray(h))
+        self.assertEqual(before, {"total": 0.0})
+        self.assertEqual(g.get_counts_at(1), h.get_counts_at(1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import io
+import unittest
+from contextlib import redirect_stdout
+from math import log10
+
+import numpy as np
+
+from hansel import hansel as hansel_module
+from hansel.hansel import Hansel
+
+SYMBOLS = ['A', 'C', 'G', 'T', 'N', '_']
+UNSYMBOLS = ['N', '_']
+N_POSITIONS = 12
+
+
+def random_hansel(seed, reweight=False):
+    rng = np.random.RandomState(seed)
+    h = Hansel.init_matrix(SYMBOLS, UNSYMBOLS, N_POSITIONS)
+    h.L = 4
+    for _ in range(400):
+        i = rng.randint(0, N_POSITIONS)
+        j = rng.randint(i+1, min(i+5, N_POSITIONS+1) + 1)
+        h.add_observation(SYMBOLS[rng.randint(5)], SYMBOLS[rng.randint(5)], i, j, rng.randint(1, 6))
+    # Unsymbol rows are left out of the spanning support, so a large one
+    # will be larger than any denominator
+    h.add_observation('N', 'A', 1, 2, 5000)
+    if reweight:
+        for _ in range(100):
+            i = rng.randint(0, N_POSITIONS)
+            h.reweight_observation(rng.randint(6), rng.randint(6), i, i+1, rng.rand())
+        h.reweight_matrix(0.2)
+    return h, rng
+
+
+def random_paths(h, rng, n_paths=20):
+    for _ in range(n_paths):
+        path = [SYMBOLS.index('_')]
+        for pos in range(1, N_POSITIONS+1):
+            yield pos, list(path)
+            path.append(rng.randint(4))
+
+
+def expected_edge_weights(h, symbol_pos, current_path):
+    # Score each branch one conditional at a time with the public API
+    counts = h.get_counts_at(symbol_pos)
+    weights = {}
+    for symbol in counts:
+        if symbol == "total" or h.symbols[symbol] in h.unsymbols:
+            continue
+        w = 0.0
+        if symbol_pos > 1:
+            for l in range(min(len(current_path)-1, h.L)):
+                curr_i = len(current_path) - 1 - l
+                w += log10(h.get_conditional_of_at(current_path[curr_i], symbol, curr_i, symbol_pos))
+        weights[symbol] = w + log10(h.get_marginal_of_at(symbol, symbol_pos))
+    return weights
+
+
+class EdgeWeightsParityTest(unittest.TestCase):
+
+    def setUp(self):
+        self.kernel = hansel_module._kernels.edge_log_conditionals
+
+    def tearDown(self):
+        hansel_module._kernels.edge_log_conditionals = self.kernel
+
+    def assertWeightsEqual(self, a, b):
+        self.assertEqual(set(a), set(b))
+        for symbol in a:
+            # Cells are float32, which the scalar and vector paths promote at different steps
+            self.assertAlmostEqual(a[symbol], b[symbol], places=6)
+
+    def edge_weights(self, h, symbol_pos, current_path, kernel):
+        hansel_module._kernels.edge_log_conditionals = kernel
+        try:
+            return h.get_edge_weights_at(symbol_pos, current_path)
+        except ZeroDivisionError:
+            return ZeroDivisionError
+
+    def test_numpy_matches_conditionals(self):
+        for reweight in (False, True):
+            for seed in range(5):
+                h, rng = random_hansel(seed, reweight)
+                for symbol_pos, path in random_paths(h, rng):
+                    try:
+                        expected = expected_edge_weights(h, symbol_pos, path)
+                    except ZeroDivisionError:
+                        expected = ZeroDivisionError
+                    actual = self.edge_weights(h, symbol_pos, path, None)
+                    if expected is ZeroDivisionError:
+                        self.assertIs(actual, ZeroDivisionError)
+                    else:
+                        self.assertWeightsEqual(actual, expected)
+
+    @unittest.skipIf(hansel_module._kernels.edge_log_conditionals is None, "numba is not installed")
+    def test_kernel_matches_numpy(self):
+        for reweight in (False, True):
+            for seed in range(5):
+                h, rng = random_hansel(seed, reweight)
+                for symbol_pos, path in random_paths(h, rng):
+                    expected = self.edge_weights(h, symbol_pos, path, None)
+                    actual = self.edge_weights(h, symbol_pos, path, self.kernel)
+                    if expected is ZeroDivisionError:
+                        self.assertIs(actual, ZeroDivisionError)
+                    else:
+                        self.assertWeightsEqual(actual, expected)
+
+    def test_zero_denominator_raises(self):
+        # Nothing is seen at position 1 and nothing spans 1 and 3, so the
+        # conditional of C at 3 given the path at 1 has no support at all
+        h = Hansel.init_matrix(SYMBOLS, UNSYMBOLS, 6)
+        h.L = 2
+        h.add_observation('A', 'C', 2, 3)
+        h.add_observation('C', 'G', 3, 4)
+        for kernel in {None, self.kernel}:
+            self.assertIs(self.edge_weights(h, 3, [5, 0, 2], kernel), ZeroDivisionError)
+        with self.assertRaises(ZeroDivisionError), redirect_stdout(io.StringIO()):
+            h.get_edge_weights_at(3, [5, 0, 2], debug=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
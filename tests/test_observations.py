@@ -0,0 +1,92 @@
+import unittest
+
+import numpy as np
+
+from hansel.hansel import Hansel
+
+
+class SymbolsToIdxTest(unittest.TestCase):
+
+    def test_str_without_byte_table(self):
+        # A symbol outside latin-1 leaves no byte table, so a str must be
+        # looked up symbol by symbol rather than read as byte values
+        h = Hansel.init_matrix(['A', 'C', 'Δ'], [], 3)
+        h.add_sequence_observations("ACΔ", 1)
+        h.add_observations("A", "C", [1], [2])
+        self.assertEqual(h[1, 2, 0, 1], 2)
+        self.assertEqual(h[1, 3, 0, 2], 1)
+        self.assertEqual(h[2, 3, 1, 2], 1)
+        self.assertEqual(np.asarray(h).sum(), 4)
+
+    def test_str_is_never_read_as_indices(self):
+        # With 66+ symbols, ord('A') is itself a valid symbol index
+        symbols = [chr(0x100 + i) for i in range(70)] + ['A', 'C']
+        h = Hansel.init_matrix(symbols, [], 3)
+        h.add_sequence_observations("AC", 1)
+        h.add_sequence_observations(b"AC", 1)
+        self.assertEqual(h[1, 2, 70, 71], 2)
+        self.assertEqual(np.asarray(h).sum(), 2)
+
+
+class AddObservationsTest(unittest.TestCase):
+
+    def test_scalar_positions_with_warm_caches(self):
+        h = Hansel.init_matrix(['A', 'C', 'G', 'T'], [], 3)
+        h.add_observation('A', 'C', 1, 2)
+        self.assertEqual(h.get_spanning_support(1, 1, 2), 1.0)
+        h.add_observations("AG", "CC", 1, 2)
+        self.assertEqual(h.get_spanning_support(1, 1, 2), 3.0)
+        self.assertEqual(h.get_counts_at(1)["total"], 3.0)
+
+
+SYMBOLS = ['A', 'C', 'G', 'T', 'N', '_']
+
+
+def one_at_a_time(observations, n_positions=10):
+    h = Hansel.init_matrix(SYMBOLS, ['N', '_'], n_positions)
+    for symbol_from, symbol_to, pos_from, pos_to, value in observations:
+        h.add_observation(symbol_from, symbol_to, pos_from, pos_to, value)
+    return np.asarray(h)
+
+
+class BatchedObservationsTest(unittest.TestCase):
+
+    def test_add_sequence_observations(self):
+        rng = np.random.RandomState(0)
+        for _ in range(20):
+            sequence = ''.join(rng.choice(SYMBOLS, rng.randint(0, 8)))
+            pos_start = rng.randint(0, 4)
+            expected = one_at_a_time([
+                (sequence[i], sequence[j], pos_start+i, pos_start+j, 2)
+                for i in range(len(sequence)) for j in range(i+1, len(sequence))
+            ])
+            # As a str and bytes (through the byte table) and as a list of symbols
+            for given in (sequence, sequence.encode("ascii"), list(sequence)):
+                h = Hansel.init_matrix(SYMBOLS, ['N', '_'], 10)
+                h.add_sequence_observations(given, pos_start, value=2)
+                np.testing.assert_array_equal(np.asarray(h), expected)
+
+    def test_add_observations(self):
+        rng = np.random.RandomState(1)
+        for _ in range(20):
+            # Positions in either order, with repeated pairs
+            observations = [
+                (rng.choice(SYMBOLS), rng.choice(SYMBOLS), i, j, rng.randint(1, 4))
+                for i, j in rng.randint(0, 11, (rng.randint(0, 30), 2)).tolist() if i != j
+            ]
+            expected = one_at_a_time(observations)
+            symbols_from, symbols_to, positions_from, positions_to, values = (
+                [list(x) for x in zip(*observations)] if observations else [[]] * 5
+            )
+
+            h = Hansel.init_matrix(SYMBOLS, ['N', '_'], 10)
+            h.add_observations(''.join(symbols_from), ''.join(symbols_to), positions_from, positions_to, values)
+            np.testing.assert_array_equal(np.asarray(h), expected)
+
+            h = Hansel.init_matrix(SYMBOLS, ['N', '_'], 10)
+            h.add_observations(symbols_from, ''.join(symbols_to).encode("ascii"), np.array(positions_from), positions_to, values)
+            np.testing.assert_array_equal(np.asarray(h), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
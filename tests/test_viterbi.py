@@ -0,0 +1,68 @@
+import itertools
+import random
+import unittest
+
+from hansel.hansel import Hansel
+
+SYMBOLS = ['A', 'C', 'G', '_']
+UNSYMBOLS = ['_']
+N_POSITIONS = 5
+
+
+def random_hansel(seed):
+    rng = random.Random(seed)
+    h = Hansel.init_matrix(SYMBOLS, UNSYMBOLS, N_POSITIONS)
+    h.L = 1
+    for _ in range(rng.randint(5, 60)):
+        i = rng.randint(0, N_POSITIONS)
+        j = min(N_POSITIONS+1, i + rng.randint(1, 3))
+        h.add_observation(rng.choice(SYMBOLS[:3]), rng.choice(SYMBOLS), i, j)
+    for _ in range(10):
+        i = rng.randint(0, N_POSITIONS)
+        h.reweight_observation(rng.randrange(4), rng.randrange(4), i, i+1, rng.random())
+    return h
+
+
+def path_score(h, path):
+    # Score a path one step at a time, as a greedy traversal would
+    current_path = [SYMBOLS.index('_')]
+    total = 0.0
+    for pos, symbol in enumerate(path, 1):
+        try:
+            weights = h.get_edge_weights_at(pos, current_path)
+        except ZeroDivisionError:
+            return None
+        if symbol not in weights:
+            return None
+        total += weights[symbol]
+        current_path.append(symbol)
+    return total
+
+
+class ViterbiDecodeTest(unittest.TestCase):
+
+    def test_matches_exhaustive_search(self):
+        for seed in range(30):
+            h = random_hansel(seed)
+            path, score = h.viterbi_decode()
+            if len(path) == 0:
+                continue
+
+            # Every path over the symbols seen at each position
+            candidates = [
+                [s for s in h.get_counts_at(pos) if s != "total" and str(s) not in UNSYMBOLS]
+                for pos in range(1, len(path)+1)
+            ]
+            best = max(
+                s for s in (path_score(h, p) for p in itertools.product(*candidates)) if s is not None
+            )
+            self.assertAlmostEqual(score, best, places=9, msg="seed %d" % seed)
+            self.assertAlmostEqual(path_score(h, path), score, places=9, msg="seed %d" % seed)
+
+    def test_empty(self):
+        h = Hansel.init_matrix(SYMBOLS, UNSYMBOLS, N_POSITIONS)
+        self.assertEqual(h.viterbi_decode(), ([], float("-inf")))
+
+
+if __name__ == '__main__':
+    unittest.main()